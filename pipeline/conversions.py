@@ -3,7 +3,11 @@ A set of tools to process image files. All conversions have the type
 `fp: str, dest: Optional[str] = None) -> str`.
 
 To add a conversion, add a function and then add a flag name to the CONVERSIONS
-global list.
+global list. Conversions that can operate on a decoded image without touching
+disk should also provide an in-memory variant of type
+`img: Image.Image -> Image.Image` registered under the same flag name in
+CONVERSIONS_MEM, so pipelines that decode once and encode once can skip the
+per-conversion file round-trips.
 """
 import os
 from typing import Callable, Dict, Optional
@@ -65,9 +69,45 @@ def scale_image(fp: str, dest: Optional[str] = None) -> str:
     return new_path
 
 
+def convert_to_png_mem(img: Image.Image) -> Image.Image:
+    """
+    In-memory counterpart of `convert_to_png`. Re-encoding is deferred to the
+    final save, so this is the identity on the decoded image.
+    :param img: The image to convert.
+    :return: The image, unchanged.
+    """
+    return img
+
+
+def make_grayscale_mem(img: Image.Image) -> Image.Image:
+    """
+    In-memory counterpart of `make_grayscale`.
+    :param img: The image to convert.
+    :return: The image as single-channel grayscale.
+    """
+    return img.convert("L")
+
+
+def scale_image_mem(img: Image.Image) -> Image.Image:
+    """
+    In-memory counterpart of `scale_image`.
+    :param img: The image to convert.
+    :return: The image scaled to HEIGHT x WIDTH.
+    """
+    return img.resize((WIDTH, HEIGHT))
+
+
 # List of available conversions
 CONVERSIONS: Dict[str, Callable[[str, Optional[str]], str]] = {
     "PNG": convert_to_png,
     "Grayscale": make_grayscale,
     "Size Scaled": scale_image
 }
+
+# In-memory variants of the conversions above, for decode-once pipelines.
+# Conversions without an entry here must go through their file-based form.
+CONVERSIONS_MEM: Dict[str, Callable[[Image.Image], Image.Image]] = {
+    "PNG": convert_to_png_mem,
+    "Grayscale": make_grayscale_mem,
+    "Size Scaled": scale_image_mem
+}
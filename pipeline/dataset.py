@@ -1,21 +1,100 @@
 """
 Functions for manipulating datasets.
 """
+import csv
+import gc
+import glob
+import hashlib
 import itertools
 import os
 import shutil
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
 import json
 
 import numpy as np
 import pandas as pd
 from PIL import Image
 
-from .conversions import CONVERSIONS
-from .lib import process_map
-from .transforms import TRANSFORMS
+from .conversions import CONVERSIONS, CONVERSIONS_MEM
+from .lib import POOL_SIZE, process_map
+from .transforms import TRANSFORMS, TRANSFORMS_BATCHED
 from .store import CLASSES, DEFAULT_CLASS
 
+# Optional SIMD-accelerated decoders; PIL is used when they are unavailable.
+try:
+    from turbojpeg import TurboJPEG, TJCS_GRAY, TJPF_GRAY, TJPF_RGB
+    _TURBOJPEG = TurboJPEG()
+except Exception:
+    _TURBOJPEG = None
+
+try:
+    import imagecodecs as _imagecodecs
+except ImportError:
+    _imagecodecs = None
+
+
+def _cache_key(file: str, conversions_to_apply: List[str]) -> str:
+    """
+    Builds a content-addressed cache key for a source file and the conversions
+    applied to it.
+    :param file: The source file.
+    :param conversions_to_apply: The conversions applied to the file.
+    :return: The cache key.
+    """
+    with open(file, "rb") as f:
+        content = hashlib.sha256(f.read()).hexdigest()
+    convs = hashlib.sha1(",".join(conversions_to_apply).encode()).hexdigest()
+    return f"{content}-{convs}"
+
+
+def _copy_and_apply(dataset: str, file: str,
+                    conversions_to_apply: List[str]) -> str:
+    """
+    Copies a file to a dataset and applies conversions. Converted outputs are
+    cached in data/cache keyed by source content and conversion list, so a
+    file already processed with the same conversions is hardlinked instead of
+    reprocessed. When every conversion has an in-memory variant, the image is
+    decoded once, the conversions are chained in memory, and the result is
+    encoded once, instead of paying a decode/encode round-trip per conversion.
+    :param dataset: The path to the dataset folder.
+    :param file: The file to copy and process.
+    :param conversions_to_apply: The conversions to apply after copying.
+    :return: The path to the processed image in the dataset.
+    """
+    img_path = f"{dataset}/images/{os.path.basename(file)}"
+    key = _cache_key(file, conversions_to_apply) \
+        if conversions_to_apply else None
+    if key:
+        hits = glob.glob(f"data/cache/{key}.*")
+        if hits:
+            img_path = \
+                f"{'.'.join(img_path.split('.')[:-1])}.{hits[0].split('.')[-1]}"
+            try:
+                os.link(hits[0], img_path)
+            except OSError:
+                shutil.copyfile(hits[0], img_path)
+            return img_path
+    if conversions_to_apply and \
+            all(c in CONVERSIONS_MEM for c in conversions_to_apply):
+        if "PNG" in conversions_to_apply:
+            img_path = f"{'.'.join(img_path.split('.')[:-1])}.png"
+        img = Image.open(file)
+        for c in conversions_to_apply:
+            img = CONVERSIONS_MEM[c](img)
+        img.save(img_path)
+        img.close()
+    else:
+        shutil.copyfile(file, img_path)
+        for c in conversions_to_apply:
+            img_path = CONVERSIONS[c](img_path)
+    if key:
+        try:
+            os.link(img_path, f"data/cache/{key}.{img_path.split('.')[-1]}")
+        except OSError:
+            pass
+    return img_path
+
 
 def new_dataset(filenames: List[str], conversions: List[str],
                 from_store=True) -> str:
@@ -26,11 +105,15 @@ def new_dataset(filenames: List[str], conversions: List[str],
     :param from_store: Whether the images are from the store.
     :return: The path to the dataset folder.
     """
-    # Create new dataset
-    datasets = os.listdir("data/datasets")
-    i = next(i for i in itertools.count() if f"dataset-{i}" not in datasets)
-    dataset = f"data/datasets/dataset-{i}"
-    os.mkdir(dataset)
+    # Create new dataset, using mkdir's atomicity to claim the next free id
+    # so concurrent callers cannot race each other to the same folder.
+    for i in itertools.count():
+        dataset = f"data/datasets/dataset-{i}"
+        try:
+            os.mkdir(dataset)
+            break
+        except FileExistsError:
+            continue
     os.mkdir(f"{dataset}/images")
     with open(f"{dataset}/process.json", "w+") as f:
         json.dump(
@@ -38,8 +121,11 @@ def new_dataset(filenames: List[str], conversions: List[str],
 
     # Add images
     if from_store:
-        df_store = pd.read_csv("data/log.csv", index_col="Index")
-        df = df_store[[f in filenames for f in df_store["File"]]]
+        df_store = pd.read_csv(
+            "data/log.csv", index_col="Index",
+            usecols=["Index", "File", "Class", *conversions],
+            dtype={"File": str, "Class": str})
+        df = df_store[df_store["File"].isin(set(filenames))]
         conversions_left = [
             (r, [c for c in conversions if not r[c]])
             for _, r in df.iterrows()
@@ -48,26 +134,18 @@ def new_dataset(filenames: List[str], conversions: List[str],
         conversions_left = [({"File": f, "Class": DEFAULT_CLASS}, conversions)
                             for f in filenames]
 
-    def _copy_and_apply(file: str, conversions_to_apply: List[str]) -> str:
-        """
-        Copies a file to a dataset and applies conversions.
-        :param file: The file to copy and process.
-        :param conversions_to_apply: The conversions to apply after copying.
-        :return: None.
-        """
-        img = f"{dataset}/images/{os.path.basename(file)}"
-        shutil.copyfile(file, img)
-        for c in conversions_to_apply:
-            img = CONVERSIONS[c](img)
-        return img
-
-    new_images = process_map(_copy_and_apply,
-                             [(r["File"], cs) for r, cs in conversions_left],
-                             packed=True)
-    new_data = [(new, r["Class"]) for new, (r, _)
-                in zip(new_images, conversions_left)]
-    new_df = pd.DataFrame(new_data, columns=["File", "Class"])
-    new_df.to_csv(f"{dataset}/log.csv", index_label="Index")
+    chunksize = max(1, len(conversions_left) // (POOL_SIZE * 4))
+    with ProcessPoolExecutor(POOL_SIZE) as ex:
+        new_images = list(ex.map(_copy_and_apply,
+                                 itertools.repeat(dataset),
+                                 [r["File"] for r, _ in conversions_left],
+                                 [cs for _, cs in conversions_left],
+                                 chunksize=chunksize))
+    with open(f"{dataset}/log.csv", "w", newline="") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(["Index", "File", "Class"])
+        w.writerows((i, new, r["Class"]) for i, (new, (r, _))
+                    in enumerate(zip(new_images, conversions_left)))
     return dataset
 
 
@@ -80,60 +158,186 @@ def delete_dataset(dataset: str) -> None:
     shutil.rmtree(dataset)
 
 
+def _update_process(dataset: str, key: str, value: Any) -> None:
+    """
+    Updates one field of a dataset's process metadata with a single read and
+    a single truncating write.
+    :param dataset: The dataset whose process metadata to update.
+    :param key: The metadata field to set.
+    :param value: The value to set the field to.
+    :return: None.
+    """
+    with open(f"{dataset}/process.json", "r") as f:
+        data = json.load(f)
+    data[key] = value
+    with open(f"{dataset}/process.json", "w") as f:
+        json.dump(data, f)
+
+
 def _load_image_array(fp: str) -> np.ndarray:
     """
-    Converts an image on disk to a numpy array.
+    Converts an image on disk to a numpy array. Uses SIMD-accelerated decoders
+    (turbojpeg for JPEG, imagecodecs for PNG) when available, falling back to
+    PIL otherwise.
     :param fp: The image to convert.
     :return: The image data as a numpy array.
     """
+    extension = fp.split('.')[-1].lower()
+    if _TURBOJPEG is not None and extension in ("jpg", "jpeg"):
+        with open(fp, "rb") as f:
+            data = f.read()
+        gray = _TURBOJPEG.decode_header(data)[3] == TJCS_GRAY
+        arr = _TURBOJPEG.decode(
+            data, pixel_format=TJPF_GRAY if gray else TJPF_RGB)
+        # PIL returns 2-D arrays for grayscale; drop turbojpeg's channel axis
+        return arr[:, :, 0] if gray else arr
+    if _imagecodecs is not None and extension == "png":
+        with open(fp, "rb") as f:
+            data = f.read()
+        # Only 8-bit gray/RGB/RGBA PNGs (IHDR bit depth and color type)
+        # decode identically to PIL; palette and 16-bit files fall back.
+        if len(data) > 25 and data[24] == 8 and data[25] in (0, 2, 6):
+            return _imagecodecs.png_decode(data)
     img = Image.open(fp)
-    arr = np.array(img)
+    img.load()  # Force loading of the image into memory
+    arr = np.asarray(img)
     img.close()
     return arr
 
 
-def _make_imageset(dataset: str, transforms: List[str]) -> bool:
+def _load_and_transform(fp: str, transforms: List[str]) -> np.ndarray:
+    """
+    Loads an image from disk and applies a series of transforms in a single
+    worker pass, so each image crosses the worker boundary only once instead
+    of once per transform stage.
+    :param fp: The image to load.
+    :param transforms: The names of the transforms to apply, in order.
+    :return: The transformed image data as a numpy array.
+    """
+    arr = _load_image_array(fp)
+    for name in transforms:
+        arr = TRANSFORMS[name](arr)
+    return arr
+
+
+def _load_transform_into(fp: str, i: int, out: np.ndarray,
+                         transforms: List[str]) -> None:
+    """
+    Loads and transforms an image and writes it into slot i of a preallocated
+    output array.
+    :param fp: The image to load.
+    :param i: The index of the output slot to write to.
+    :param out: The preallocated output array.
+    :param transforms: The names of the transforms to apply, in order.
+    :return: None.
+    """
+    np.copyto(out[i], _load_and_transform(fp, transforms),
+              casting="same_kind")
+
+
+def _save_array_chunked(path: str, arr: np.ndarray,
+                        chunk_bytes: int = 4 * 1024 * 1024) -> None:
+    """
+    Saves an array in .npy format by streaming rows into a memmap in pieces
+    of roughly chunk_bytes, instead of np.save's single full-buffer write,
+    keeping the transient page-cache footprint bounded.
+    :param path: The path to save the array to.
+    :param arr: The array to save.
+    :param chunk_bytes: The approximate number of bytes to write at a time.
+    :return: None.
+    """
+    mm = np.lib.format.open_memmap(path, mode="w+", dtype=arr.dtype,
+                                   shape=arr.shape)
+    rows = max(1, chunk_bytes // max(1, arr[0].nbytes))
+    for i in range(0, arr.shape[0], rows):
+        mm[i:i + rows] = arr[i:i + rows]
+    mm.flush()
+
+
+def _make_imageset(dataset: str, transforms: List[str],
+                   df: Optional[pd.DataFrame] = None) -> bool:
     """
     Loads the images from dataset image store, applies a series of transforms,
-    and saves the result to the dataset.
+    and saves the result to the dataset. Workers share the process address
+    space and write into a pre-slotted output buffer (the X.npy memmap or the
+    in-memory stack), so image data is never serialized between workers.
     :param transforms: A list of transform functions to apply when loading.
     :param dataset: The path to the dataset.
+    :param df: A preloaded dataset log, to avoid re-reading it from disk.
     :return: Whether the operation was successful.
     """
     try:
-        df = pd.read_csv(f"{dataset}/log.csv")
+        if df is None:
+            df = pd.read_csv(f"{dataset}/log.csv", usecols=["File"],
+                             dtype={"File": str})
         fps = list(df["File"])
-        images = process_map(_load_image_array, fps)
+        if not fps:
+            np.save(f"{dataset}/X.npy", np.array([]))
+        elif transforms and all(f in TRANSFORMS_BATCHED for f in transforms):
+            # Load the raw images into one stack, then run each transform
+            # once over the whole stack instead of once per image.
+            probe = _load_image_array(fps[0])
+            stack = np.empty((len(fps), *probe.shape), dtype=probe.dtype)
+            stack[0] = probe
+            gc.disable()
+            try:
+                process_map(_load_transform_into,
+                            [(fp, i, stack, [])
+                             for i, fp in enumerate(fps[1:], start=1)],
+                            packed=True)
+            finally:
+                gc.enable()
+            for f in transforms:
+                stack = TRANSFORMS_BATCHED[f](stack)
+            _save_array_chunked(f"{dataset}/X.npy", stack)
+        else:
+            # Probe one image through the transform chain to size the output,
+            # then have workers write their slots into the memmap directly so
+            # the full image set is never duplicated in memory.
+            probe = _load_and_transform(fps[0], transforms)
+            mm = np.lib.format.open_memmap(
+                f"{dataset}/X.npy", mode="w+", dtype=probe.dtype,
+                shape=(len(fps), *probe.shape))
+            mm[0] = probe
+            # The load/transform loop allocates no reference cycles, so the
+            # cyclic collector only adds scan overhead while it runs.
+            gc.disable()
+            try:
+                process_map(_load_transform_into,
+                            [(fp, i, mm, transforms)
+                             for i, fp in enumerate(fps[1:], start=1)],
+                            packed=True)
+            finally:
+                gc.enable()
+            mm.flush()
+            del mm
     except FileNotFoundError:
         return False
-    for f in transforms:
-        images = process_map(TRANSFORMS[f], images)
-    with open(f"{dataset}/process.json", "r") as f:
-        data = json.load(f)
-        data["Transforms"] = transforms
-    with open(f"{dataset}/process.json", "w+") as f:
-        json.dump(data, f)
-    np.save(f"{dataset}/X.npy", np.array(images))
+    _update_process(dataset, "Transforms", transforms)
     return True
 
 
-def _make_labelset(dataset: str, bundled: bool = True) -> bool:
+def _make_labelset(dataset: str, bundled: bool = True,
+                   df: Optional[pd.DataFrame] = None) -> bool:
     """
     Turns the labels of a dataset into training data labels, applying bundling
     of chart classes if desired.
     :param dataset: The dataset to create label data for.
     :param bundled: Whether the chart classes should be bundled.
+    :param df: A preloaded dataset log, to avoid re-reading it from disk.
     :return: Whether the operation was successful.
     """
-    df = pd.read_csv(f"{dataset}/log.csv")
-    classes = [int(bool(CLASSES[c])) if bundled else CLASSES[c] for c in
-               df["Class"]]
-    with open(f"{dataset}/process.json", "r") as f:
-        data = json.load(f)
-        data["Bundled"] = bundled
-    with open(f"{dataset}/process.json", "w+") as f:
-        json.dump(data, f)
-    np.save(f"{dataset}/Y.npy", np.array(classes))
+    if df is None:
+        df = pd.read_csv(f"{dataset}/log.csv", usecols=["Class"],
+                         dtype={"Class": str})
+    vals = df["Class"].map(CLASSES).to_numpy()
+    if bundled:
+        classes = (vals != 0).astype(np.int8)
+    else:
+        assert vals.size == 0 or vals.max() < np.iinfo(np.int16).max
+        classes = vals.astype(np.int16, copy=False)
+    _update_process(dataset, "Bundled", bundled)
+    np.save(f"{dataset}/Y.npy", classes)
     return True
 
 
@@ -146,8 +350,13 @@ def make_data(dataset: str, transforms: List[str],
     :param bundled: Whether the label classes should be bundled.
     :return: Whether the operation was successful.
     """
-    return _make_imageset(dataset, transforms) and \
-           _make_labelset(dataset, bundled)
+    try:
+        df = pd.read_csv(f"{dataset}/log.csv", usecols=["File", "Class"],
+                         dtype={"File": str, "Class": str})
+    except FileNotFoundError:
+        return False
+    return _make_imageset(dataset, transforms, df) and \
+           _make_labelset(dataset, bundled, df)
 
 
 def get_process(dataset: str) -> Dict[str, Any]:
@@ -1,20 +1,39 @@
+import atexit
 from multiprocessing.pool import ThreadPool
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 # Process count for multiprocessing
 POOL_SIZE = 4
 
+# Lazily-initialized persistent worker pool, shared by all process_map calls
+# to avoid paying pool startup cost per call.
+_POOL: Optional[ThreadPool] = None
+
+
+def _get_pool() -> ThreadPool:
+    """
+    Returns the shared worker pool, creating it on first use.
+    :return: The module-level worker pool.
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPool(POOL_SIZE)
+        atexit.register(_POOL.terminate)
+    return _POOL
+
 
 def process_map(f: Callable, args: List, packed: bool = False) -> List:
     """
-    Maps an operation from conversions.py across multiple processes.
+    Maps an operation from conversions.py across multiple workers. Work is
+    submitted in chunks to amortize per-item dispatch overhead.
     :param f: The function to map, from conversions.py.
     :param args: The list of argument tuples to map over.
     :param packed: Whether the args list consists of packed argument tuples.
     :return: The list of outputs from the mapping of f over args.
     """
-    with ThreadPool(POOL_SIZE) as p:
-        if packed:
-            return p.starmap(f, args)
-        else:
-            return p.map(f, args)
+    p = _get_pool()
+    chunksize = max(1, len(args) // (POOL_SIZE * 4))
+    if packed:
+        return p.starmap(f, args, chunksize=chunksize)
+    else:
+        return p.map(f, args, chunksize=chunksize)
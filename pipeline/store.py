@@ -64,6 +64,8 @@ def init_data_store() -> None:
         _init_label_store()
     except FileExistsError:
         pass
+    # Added after the original layout, so create it for existing stores too.
+    os.makedirs("data/cache", exist_ok=True)
 
 
 def import_images(images: List[str], labels: Optional[List[str]] = None,
@@ -3,7 +3,11 @@ A set of tools to process image arrays. All transforms have the type
 `(arr: np.ndarray) -> np.ndarray`.
 
 To add a transform, add a function and then add a flag name to the TRANSFORMS
-global dictionary.
+global dictionary. Transforms that can operate on a whole stacked image set
+(an array with a leading image axis) in one vectorized call should also be
+registered under the same flag name in TRANSFORMS_BATCHED; the dataset
+pipeline prefers the batched form and falls back to mapping the per-image
+form otherwise.
 """
 
 from typing import Callable, Dict
@@ -34,8 +38,24 @@ def flatten(arr: np.ndarray) -> np.ndarray:
     return arr.flatten()
 
 
+def flatten_batched(arr: np.ndarray) -> np.ndarray:
+    """
+    Flattens each image of a stacked image set.
+    :param arr: An array of images with a leading image axis.
+    :return: A view of the array with each image collapsed to one dimension.
+    """
+    return arr.reshape(arr.shape[0], -1)
+
+
 # List of available transforms
 TRANSFORMS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
     "Scale Pixels": scale_pixels,
     "Flatten": flatten
 }
+
+# Vectorized whole-stack variants of the transforms above. `scale_pixels` is
+# already shape-agnostic, so it doubles as its own batched form.
+TRANSFORMS_BATCHED: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "Scale Pixels": scale_pixels,
+    "Flatten": flatten_batched
+}